@@ -0,0 +1,171 @@
+# Alternate asyncio front end for the Mini-Redis server.
+# asyncio's StreamReader buffers in C and uvloop replaces the event
+# loop with libuv, so each parsed message costs fewer scheduler trips
+# than the greenlet switches in the gevent front end.
+# The gevent server in server.py stays the default entry point; this
+# one serves the same commands and wire format:
+#   python async_server.py
+
+import asyncio
+import logging
+import socket
+
+from server import KV, CommandError, Disconnect, Error, ProtocolHandler, Raw, Server
+from server import _MAX_PREALLOC, _NO_KEY
+
+# uvloop is optional; the stock event loop works the same, just slower
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+logger = logging.getLogger(__name__)
+
+class AsyncProtocolHandler(ProtocolHandler):
+    # Same iterative frame stack as the synchronous parser, driven
+    # by asyncio's buffered StreamReader instead of a SocketReader
+    async def handle_request(self, reader):
+        # Array frames are [slots, filled, False, total];
+        # dict frames are [d, pairs_left, True, pending_key]
+        stack = []
+
+        while True:
+            try:
+                first_byte = await reader.readexactly(1)
+            except asyncio.IncompleteReadError:
+                raise Disconnect()
+            tag = first_byte[0]
+
+            if tag == 42: # '*'
+                # Negative counts (the RESP null array) fall through
+                # to the empty value; pushing a frame for them would
+                # index past the preallocated slots
+                num_elements = int(await reader.readuntil(b"\r\n"))
+                if num_elements > 0:
+                    # Preallocated but capped, like the synchronous
+                    # parsers: the advertised count alone must not
+                    # balloon memory before any element bytes arrive
+                    value = [None] * min(num_elements, _MAX_PREALLOC)
+                    stack.append([value, 0, False, num_elements])
+                    continue
+                value = []
+            elif tag == 37: # '%'
+                num_elements = int(await reader.readuntil(b"\r\n"))
+                value = {}
+                if num_elements > 0:
+                    stack.append([value, num_elements, True, _NO_KEY])
+                    continue
+            elif tag == 36: # '$'
+                length = int(await reader.readuntil(b"\r\n"))
+                if length == -1:
+                    value = None
+                else:
+                    data = await reader.readexactly(length + 2)
+                    value = data[:-2]
+            elif tag == 43: # '+'
+                value = (await reader.readuntil(b"\r\n"))[:-2]
+            elif tag == 58: # ':'
+                value = int(await reader.readuntil(b"\r\n"))
+            elif tag == 45: # '-'
+                line = await reader.readuntil(b"\r\n")
+                value = Error(line[:-2].decode("utf-8", errors = "strict"))
+            else:
+                raise CommandError('Bad Request')
+
+            while True:
+                if not stack:
+                    return value
+                frame = stack[-1]
+                if frame[2]:
+                    # Dict frame: a key, then the value it maps to
+                    key = frame[3]
+                    if key is _NO_KEY:
+                        frame[3] = value
+                        break
+                    frame[0][key] = value
+                    frame[3] = _NO_KEY
+                    frame[1] -= 1
+                    if frame[1]:
+                        break
+                    stack.pop()
+                    value = frame[0]
+                else:
+                    slots = frame[0]
+                    if frame[1] < len(slots):
+                        slots[frame[1]] = value
+                    else:
+                        slots.append(value)
+                    frame[1] += 1
+                    if frame[1] < frame[3]:
+                        break
+                    stack.pop()
+                    value = slots
+
+class AsyncServer(Server):
+    def __init__(self, host = '127.0.0.1', port = 31337, max_clients = 64):
+        # Skips Server.__init__ on purpose: no gevent pool or
+        # StreamServer, but the same store and command table
+        self._protocol = AsyncProtocolHandler()
+        self._kv = KV()
+        self._commands = self.get_commands()
+        self._host = host
+        self._port = port
+        self._max_clients = max_clients
+
+    async def connection_handler(self, reader, writer):
+        address = writer.get_extra_info('peername')
+        logger.info("Connection received: %s:%s", address[0], address[1])
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        try:
+            async with self._sem:
+                # Processes client requests until the client disconnects
+                while True:
+                    try:
+                        data = await self._protocol.handle_request(reader)
+                    except Disconnect:
+                        logger.info("Client disconnected: %s:%s", address[0], address[1])
+                        break
+
+                    try:
+                        resp = self.get_response(data)
+                    except CommandError as exc:
+                        logger.exception('Command error')
+                        resp = Error(exc.args[0])
+
+                    if type(resp) is Raw:
+                        # Already on the wire format
+                        writer.write(resp.data)
+                    else:
+                        writer.write(self._protocol._encode(resp))
+                    await writer.drain()
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    async def _serve(self):
+        self._sem = asyncio.Semaphore(self._max_clients)
+        server = await asyncio.start_server(
+            self.connection_handler,
+            self._host,
+            self._port,
+            limit = 1 << 20 # Large read buffer, like SocketReader
+        )
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        if uvloop is not None:
+            uvloop.install()
+        asyncio.run(self._serve())
+
+if __name__ == '__main__':
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.DEBUG)
+
+    AsyncServer().run()
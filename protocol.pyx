@@ -0,0 +1,283 @@
+# cython: language_level=3
+# Bounds checks stay on: the frame-stack indices are derived from
+# wire data, and an unchecked write is memory corruption rather
+# than a clean IndexError if a guard is ever wrong.
+# Compiled twin of the ProtocolHandler in server.py.
+# The RESP hot loop is pure byte munging, so running it as C
+# instead of interpreted bytecode is a large win. Build it with
+#   python setup.py build_ext --inplace
+# and server.py will pick it up automatically when present.
+
+from collections import namedtuple
+
+from libc.errno cimport ERANGE, errno
+from libc.limits cimport LONG_MAX, LONG_MIN
+from libc.stdio cimport snprintf
+from libc.stdlib cimport strtol
+from cpython.bytes cimport PyBytes_FromStringAndSize
+
+# Same wire level errors as server.py; the server aliases these
+# when the extension is loaded so except clauses keep matching
+class CommandError(Exception):
+    pass
+class Disconnect(Exception):
+    pass
+
+Error = namedtuple('Error', ('message',))
+
+
+# Parses a length or integer line with strtol.
+# strtol stops at the '\r', so the trailing CRLF needs no strip,
+# but it clamps out-of-range input to LONG_MIN/LONG_MAX and
+# ignores trailing garbage unless errno and the end pointer are
+# checked: b':12abc' and 21-digit integers must both be rejected
+# rather than silently mangled
+cdef long _parse_int(bytes line) except *:
+    cdef const char* start = line
+    cdef char* end = NULL
+    global errno
+    errno = 0
+    cdef long value = strtol(start, &end, 10)
+    if end == start or errno == ERANGE:
+        raise CommandError('Bad Request')
+    if end[0] != c'\r' and end[0] != c'\n' and end[0] != 0:
+        raise CommandError('Bad Request')
+    return value
+
+
+# Formats b"<tag><value>\r\n" into a stack buffer in one pass
+cdef bytes _int_header(char tag, long value):
+    cdef char out[32]
+    cdef int n = snprintf(out, sizeof(out), b"%c%ld\r\n", tag, value)
+    return PyBytes_FromStringAndSize(out, n)
+
+
+# Precomputed headers for small integer replies and bulk lengths,
+# shared objects so the common case allocates nothing
+cdef list _int_cache = [_int_header(c':', i) for i in range(1024)]
+cdef list _len_cache = [_int_header(c'$', i) for i in range(4096)]
+
+# Sentinel for "no key parsed yet" in dict frames; None cannot be
+# used because $-1 parses to None and is a legal key
+cdef object _NO_KEY = object()
+
+# Caps how many container slots are preallocated up front; a client
+# must actually send element bytes before the server commits more
+# memory than this to its advertised count
+cdef Py_ssize_t _MAX_PREALLOC = 65536
+
+
+cdef class ProtocolHandler:
+
+    # Analyzes a request from the client into its component parts.
+    # Same iterative frame stack as the Python version, but the tag
+    # dispatch is a C switch and the helpers are C calls
+    def handle_request(self, socket_file):
+        # Array frames are [slots, filled, False, total];
+        # dict frames are [d, pairs_left, True, pending_key] and
+        # fill in a single pass as key/value pairs arrive
+        cdef list stack = []
+        cdef list frame, slots
+        cdef long num_elements
+        cdef Py_ssize_t filled
+        cdef int tag
+        cdef object value, key
+        cdef bytes first_byte
+
+        while True:
+            first_byte = socket_file.read(1)
+            if not first_byte:
+                raise Disconnect()
+            tag = first_byte[0]
+
+            if tag == 42: # '*'
+                # Negative counts (the RESP null array) fall through
+                # to the empty value; pushing a frame for them would
+                # index past the preallocated slots
+                num_elements = _parse_int(socket_file.readline())
+                if num_elements > 0:
+                    # Preallocated so elements are assigned by index,
+                    # but capped: the advertised count alone must not
+                    # balloon memory before any element bytes arrive.
+                    # Growth past the cap is append
+                    if num_elements < _MAX_PREALLOC:
+                        value = [None] * num_elements
+                    else:
+                        value = [None] * _MAX_PREALLOC
+                    stack.append([value, 0, False, num_elements])
+                    continue
+                value = []
+            elif tag == 37: # '%'
+                num_elements = _parse_int(socket_file.readline())
+                value = {}
+                if num_elements > 0:
+                    stack.append([value, num_elements, True, _NO_KEY])
+                    continue
+            elif tag == 36: # '$'
+                value = self._read_string(socket_file)
+            elif tag == 43: # '+'
+                # Payloads stay as bytes all the way into the KV store
+                value = socket_file.readline()[:-2]
+            elif tag == 58: # ':'
+                value = _parse_int(socket_file.readline())
+            elif tag == 45: # '-'
+                value = Error(socket_file.readline()[:-2].decode("utf-8", "strict"))
+            else:
+                raise CommandError('Bad Request')
+
+            # Feeds the completed value into the enclosing frame,
+            # popping every frame that it finishes
+            while True:
+                if not stack:
+                    return value
+                frame = <list>stack[-1]
+                if frame[2]:
+                    # Dict frame: a key, then the value it maps to
+                    key = frame[3]
+                    if key is _NO_KEY:
+                        frame[3] = value
+                        break
+                    (<dict>frame[0])[key] = value
+                    frame[3] = _NO_KEY
+                    filled = <Py_ssize_t>frame[1] - 1
+                    frame[1] = filled
+                    if filled:
+                        break
+                    stack.pop()
+                    value = frame[0]
+                else:
+                    slots = <list>frame[0]
+                    filled = <Py_ssize_t>frame[1]
+                    if filled < len(slots):
+                        slots[filled] = value
+                    else:
+                        slots.append(value)
+                    filled += 1
+                    frame[1] = filled
+                    if filled < <long>frame[3]:
+                        break
+                    stack.pop()
+                    value = slots
+
+    cdef object _read_string(self, socket_file):
+        cdef long length = _parse_int(socket_file.readline())
+
+        # NULL
+        if length == -1:
+            return None
+
+        # One copy out of the reader's buffer, no [:-2] reslice
+        return socket_file.read_bulk(length)
+
+    # Serealizes the response data and sends it to the client.
+    # Array replies go out as a vector through sendmsg when the
+    # socket supports it, so the kernel gathers the parts with
+    # one writev instead of the join copying them first
+    def write_response(self, conn, data):
+        if type(data) is list and data:
+            self._write_list(conn, data)
+        else:
+            conn.sendall(self._encode(data))
+
+    cdef void _encode_iov(self, list values, list iov) except *:
+        cdef Py_ssize_t length
+        iov.append(_int_header(c'*', len(values)))
+        for item in values:
+            if isinstance(item, str):
+                item = item.encode("utf-8")
+            if isinstance(item, bytes):
+                length = len(item)
+                if length < 4096:
+                    iov.append(_len_cache[length])
+                else:
+                    iov.append(_int_header(c'$', length))
+                iov.append(item)
+                iov.append(b"\r\n")
+            else:
+                iov.append(self._encode(item))
+
+    cdef void _write_list(self, conn, list values) except *:
+        cdef list iov = []
+        cdef Py_ssize_t total, sent
+        self._encode_iov(values, iov)
+
+        # Kernels cap the vector length (IOV_MAX, typically 1024)
+        if len(iov) > 1024:
+            conn.sendall(b"".join(iov))
+            return
+
+        sendmsg = getattr(conn, 'sendmsg', None)
+        if sendmsg is None:
+            conn.sendall(b"".join(iov))
+            return
+
+        total = 0
+        for part in iov:
+            total += len(part)
+        sent = sendmsg(iov)
+        # sendmsg may stop short; push the remainder with sendall
+        if sent < total:
+            conn.sendall(b"".join(iov)[sent:])
+
+    # Encodes one value into a single bytes chunk.
+    # A work stack walks nested containers without recursing,
+    # then one b''.join builds the final chunk
+    cpdef bytes _encode(self, data):
+        cdef list out = []
+        cdef list stack = [data]
+        cdef list flat
+        cdef Py_ssize_t length
+
+        while stack:
+            data = stack.pop()
+
+            if isinstance(data, str):
+                data = data.encode("utf-8")
+
+            if isinstance(data, bytes):
+                length = len(data)
+                if length < 4096:
+                    out.append(_len_cache[length])
+                    out.append(data)
+                    out.append(b"\r\n")
+                else:
+                    out.append(b"".join((_int_header(c'$', length), data, b"\r\n")))
+
+            elif isinstance(data, int):
+                if 0 <= data < 1024:
+                    out.append(_int_cache[data])
+                elif LONG_MIN <= data <= LONG_MAX:
+                    out.append(_int_header(c':', data))
+                else:
+                    # Python ints overflow the C long header path
+                    out.append(b":%d\r\n" % data)
+
+            elif isinstance(data, Error):
+                msg = data.message
+                if isinstance(msg, str):
+                    msg = msg.encode("utf-8")
+                out.append(b"-%s\r\n" % msg)
+
+            elif isinstance(data, (list, tuple)):
+                out.append(_int_header(c'*', len(data)))
+                # Reversed so the pop order matches the wire order
+                stack.extend(reversed(data))
+
+            elif isinstance(data, dict):
+                out.append(_int_header(c'%', len(data)))
+                flat = []
+                for key, value in data.items():
+                    flat.append(key)
+                    flat.append(value)
+                stack.extend(reversed(flat))
+
+            elif data is None:
+                out.append(b"$-1\r\n")
+
+            else:
+                raise CommandError('Unrecognized type: %s' % type(data))
+
+        # Scalar responses skip the join entirely
+        if len(out) == 1:
+            return <bytes>out[0]
+        return b"".join(out)
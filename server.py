@@ -10,9 +10,10 @@ from gevent import socket # gevent is a 3rd party python library
 from gevent.pool import Pool # Limits how many clients can be handled at once
 from gevent.server import StreamServer # TCP server that works with gevent
 
-from collections import namedtuple # Lightweight data structure
-from io import BytesIO # Treats bytes like a file
+from collections import deque, namedtuple # Lightweight data structures
 import logging
+import re
+from typing import Any
 
 logger = logging.getLogger(__name__)
 
@@ -24,112 +25,376 @@ class Disconnect(Exception):
 
 Error = namedtuple('Error', ('message',))
 
+# Marks a response that is already encoded RESP bytes.
+# Commands with constant replies return the shared instances below,
+# so the hot path sends them without touching the serializer
+Raw = namedtuple('Raw', ('data',))
+
+_ZERO = Raw(b':0\r\n')
+_ONE = Raw(b':1\r\n')
+
+# Precomputed headers for small integer replies and bulk lengths.
+# These cover almost every reply, so the generic %-formatting only
+# runs for outliers
+_INT_CACHE = [b":%d\r\n" % i for i in range(1024)]
+_LEN_CACHE = [b"$%d\r\n" % i for i in range(4096)]
+
+# Tokenizer for inline commands ("GET key" over telnet); compiled
+# once so tokenizing runs in the regex engine's DFA loop
+_INLINE_RE = re.compile(rb'\S+')
+
+# Sentinel for "no key parsed yet" in dict frames; None cannot be
+# used because $-1 parses to None and is a legal key
+_NO_KEY = object()
+
+# Caps how many container slots are preallocated up front; a client
+# must actually send element bytes before the server commits more
+# memory than this to its advertised count
+_MAX_PREALLOC = 65536
+
+# Buffered reader over a raw socket.
+# One fixed backing buffer: recv_into lands bytes at the write
+# offset and the parser consumes from the read offset, so filling
+# costs no scratch buffer or append copy, and parsing a request is
+# buffer scans instead of one small recv per element
+class SocketReader(object):
+    chunk_size = 65536
+
+    def __init__(self, conn, buf: bytearray | None = None) -> None:
+        self._conn = conn
+        # The backing buffer can be supplied from a pool
+        self._buf = bytearray(self.chunk_size) if buf is None else buf
+        self._r = 0 # Next unread byte
+        self._w = 0 # End of valid data
+        # Called before every recv; the server hangs batched
+        # replies on this so they are flushed before the reader
+        # blocks waiting for the rest of a partially sent request
+        self.pre_recv = None
+
+    # Receives more data directly into the backing buffer.
+    # Returns False once the peer has closed the connection
+    def _fill(self) -> bool:
+        buf = self._buf
+        if self._r == self._w:
+            self._r = self._w = 0
+        elif self._w == len(buf):
+            if self._r:
+                # Shifts the unread tail to the front
+                unread = self._w - self._r
+                buf[:unread] = buf[self._r:self._w]
+                self._r = 0
+                self._w = unread
+            else:
+                # A single value larger than the buffer; doubles it
+                buf.extend(bytes(len(buf)))
+        if self.pre_recv is not None:
+            self.pre_recv()
+        n = self._conn.recv_into(memoryview(buf)[self._w:])
+        if not n:
+            return False
+        self._w += n
+        return True
+
+    # Reads exactly n bytes, or fewer if the peer disconnects.
+    # Slicing through a memoryview copies out of the buffer once,
+    # instead of a bytearray slice plus a bytes() conversion
+    def read(self, n: int) -> bytes:
+        while self._w - self._r < n:
+            if not self._fill():
+                break
+        end = min(self._r + n, self._w)
+        data = bytes(memoryview(self._buf)[self._r:end])
+        self._r = end
+        return data
+
+    # Reads an n byte bulk payload plus its trailing '\r\n',
+    # returning just the payload. One copy out of the buffer;
+    # no oversized read followed by a [:-2] slice.
+    # The copy itself stays: handing out a live memoryview would
+    # pin the reused buffer and corrupt once it is compacted
+    def read_bulk(self, n: int) -> bytes:
+        total = n + 2
+        while self._w - self._r < total:
+            if not self._fill():
+                # The peer went away mid value
+                return self.read(total)[:-2]
+        start = self._r
+        self._r = start + total
+        return bytes(memoryview(self._buf)[start:start + n])
+
+    # True when unconsumed bytes remain, meaning the client has
+    # pipelined more data behind the request just parsed
+    def has_buffered(self) -> bool:
+        return self._r < self._w
+
+    # Reads through the next '\r\n', inclusive, like file.readline()
+    def readline(self) -> bytes:
+        idx = self._buf.find(b'\r\n', self._r, self._w)
+        while idx == -1:
+            if not self._fill():
+                # The peer went away mid line; returns what is left
+                data = bytes(memoryview(self._buf)[self._r:self._w])
+                self._r = self._w
+                return data
+            idx = self._buf.find(b'\r\n', self._r, self._w)
+        data = bytes(memoryview(self._buf)[self._r:idx + 2])
+        self._r = idx + 2
+        return data
+
 # Defines how data moves across the wire
 class ProtocolHandler(object):
-    def __init__(self):
-        self.handlers = {
-            '+': self.handle_simple_string,
-            '-': self.handle_error,
-            ':': self.handle_integer,
-            '$': self.handle_string,
-            '*': self.handle_array,
-            '%': self.handle_dict
-        }
+    def __init__(self) -> None:
+        # Scalar handlers, hottest tag first.
+        # Generated below into a straight if/elif ladder over int
+        # compares, which CPython runs faster than a list or dict
+        # dispatch for this few branches
+        handlers = (
+            ('$', 'handle_string'),
+            ('+', 'handle_simple_string'),
+            (':', 'handle_integer'),
+            ('-', 'handle_error'),
+        )
+        src = ['def _read_scalar(self, socket_file, tag):']
+        branch = 'if'
+        for ch, name in handlers:
+            src.append('    %s tag == %d: return self.%s(socket_file)'
+                       % (branch, ord(ch), name))
+            branch = 'elif'
+        src.append('    raise CommandError("Bad Request")')
+        namespace = {'CommandError': CommandError}
+        exec('\n'.join(src), namespace)
+        self._read_scalar = namespace['_read_scalar'].__get__(self)
+
+    # Analyzes a request from the client into its component parts.
+    # Containers are parsed with an explicit stack of unfinished
+    # frames instead of one Python call per element, so a huge
+    # array costs a loop iteration per item rather than a frame
+    def handle_request(self, socket_file) -> Any:
+        # Array frames are [slots, filled, False, total];
+        # dict frames are [d, pairs_left, True, pending_key] and
+        # fill in a single pass as key/value pairs arrive, with no
+        # intermediate 2N list, slice copies or zip at the end
+        stack = []
 
-    # Analyzes a request from the client into its component parts
-    def handle_request(self, socket_file):
-        first_byte = socket_file.read(1)
-        if not first_byte:
-            raise Disconnect()
-        
-        #first_byte is bytes in Python 3
-        first_byte = first_byte.decode("utf-8", errors = "strict")
-        
-        try:
-            # Delegates to the appropriate handler based on the first byte
-            return self.handlers[first_byte](socket_file)
-        except KeyError:
-            raise CommandError('Bad Request')
+        while True:
+            first_byte = socket_file.read(1)
+            if not first_byte:
+                raise Disconnect()
+            tag = first_byte[0]
+
+            if tag == 42: # '*'
+                # int() treats the trailing '\r\n' as whitespace,
+                # so the rstrip copy is unnecessary.
+                # Negative counts (the RESP null array) fall through
+                # to the empty value; pushing a frame for them would
+                # index past the preallocated slots
+                num_elements = int(socket_file.readline())
+                if num_elements > 0:
+                    # Preallocated so elements are assigned by
+                    # index, but capped: the advertised count alone
+                    # must not balloon memory before any element
+                    # bytes arrive. Growth past the cap is append
+                    value = [None] * min(num_elements, _MAX_PREALLOC)
+                    stack.append([value, 0, False, num_elements])
+                    continue
+                value = []
+            elif tag == 37: # '%'
+                num_elements = int(socket_file.readline())
+                value = {}
+                if num_elements > 0:
+                    stack.append([value, num_elements, True, _NO_KEY])
+                    continue
+            else:
+                value = self._read_scalar(socket_file, tag)
+
+            # Feeds the completed value into the enclosing frame,
+            # popping every frame that it finishes
+            while True:
+                if not stack:
+                    return value
+                frame = stack[-1]
+                if frame[2]:
+                    # Dict frame: a key, then the value it maps to
+                    key = frame[3]
+                    if key is _NO_KEY:
+                        frame[3] = value
+                        break
+                    frame[0][key] = value
+                    frame[3] = _NO_KEY
+                    frame[1] -= 1
+                    if frame[1]:
+                        break
+                    stack.pop()
+                    value = frame[0]
+                else:
+                    slots = frame[0]
+                    filled = frame[1]
+                    if filled < len(slots):
+                        slots[filled] = value
+                    else:
+                        slots.append(value)
+                    filled += 1
+                    frame[1] = filled
+                    if filled < frame[3]:
+                        break
+                    stack.pop()
+                    value = slots
         
     # For each handler
 
-    def handle_simple_string(self, socket_file):
-        return socket_file.readline().rstrip(b"\r\n").decode("utf-8", errors = "strict")
-    
-    def handle_error(self, socket_file):
+    # Payloads stay as bytes all the way into the KV store;
+    # nothing on the hot path needs to interpret them as text
+    def handle_simple_string(self, socket_file) -> bytes:
+        return socket_file.readline().rstrip(b"\r\n")
+
+    def handle_error(self, socket_file) -> Error:
         msg = socket_file.readline().rstrip(b"\r\n").decode("utf-8", errors = "strict")
         return Error(msg)
     
-    def handle_integer(self, socket_file):
-        return int(socket_file.readline().rstrip(b"\r\n"))
-    
-    def handle_string(self, socket_file):
+    def handle_integer(self, socket_file) -> int:
+        return int(socket_file.readline())
+
+    def handle_string(self, socket_file) -> bytes | None:
         # First reads the length
-        length = int(socket_file.readline().rstrip(b"\r\n"))
+        length = int(socket_file.readline())
 
         # NULL
         if length == -1:
             return None
-        
-        length += 2 # Includes the '\r\n' in count
-        data = socket_file.read(length)[:-2]
-        return data.decode("utf-8", errors = "strict")
-    
-    def handle_array(self, socket_file):
-        num_elements = int(socket_file.readline().rstrip(b"\r\n"))
-        return [self.handle_request(socket_file) for _ in range(num_elements)]
-        #return [self.handle_request(socket_file) for _ in range(num_items)]
-
-    def handle_dict(self, socket_file):
-        num_items = int(socket_file.readline().rstrip(b"\r\n"))
-        elements = [self.handle_request(socket_file) for _ in range(num_items * 2)]
-        return dict(zip(elements[::2], elements[1::2]))
-
-    # Serealizes the response data and sends it to the client
-    def write_response(self, socket_file, data):
-        buf = BytesIO()
-        self.write(buf, data)
-        buf.seek(0)
-        socket_file.write(buf.getvalue())
-        socket_file.flush()
-
-    def write(self, buf, data):
-        if isinstance(data, str):
-            data = data.encode("utf-8")
-
-        if isinstance(data, bytes):
-            buf.write(b"$%d\r\n" % len(data))
-            buf.write(data + b"\r\n")
-
-        elif isinstance(data, int):
-            buf.write(b":%d\r\n" % data)
-
-        elif isinstance(data, Error):
-            msg = data.message
-            if isinstance(msg, str):
-                msg = msg.encode("utf-8")
-            buf.write(b"-" + msg + b"\r\n")
-
-        elif isinstance(data, (list, tuple)):
-            buf.write(b"*%d\r\n" % len(data))
-            for item in data:
-                self.write(buf, item)
-
-        elif isinstance(data, dict):
-            buf.write(b"%%%d\r\n" % len(data))
-            for key, value in data.items():
-                self.write(buf, key)
-                self.write(buf, value)
-
-        elif data is None:
-            buf.write(b"$-1\r\n")
 
+        return socket_file.read_bulk(length)
+
+    # Serealizes the response data and sends it to the client.
+    # Array replies go out as a vector through sendmsg, so the
+    # kernel gathers the parts with one writev instead of the
+    # join copying every value into a staging buffer first
+    def write_response(self, conn, data: Any) -> None:
+        if type(data) is list and data:
+            self._write_list(conn, data)
         else:
-            raise CommandError('Unrecognized type: %s' % type(data))
+            conn.sendall(self._encode(data))
+
+    # Builds the iovec for an array reply: header, then for each
+    # bytes value its length line, the stored value object itself
+    # (no copy) and the terminator. Other element types fall back
+    # to their joined encoding as one entry
+    def _encode_iov(self, values: list, iov: list) -> None:
+        iov.append(b"*%d\r\n" % len(values))
+        for item in values:
+            if isinstance(item, str):
+                item = item.encode("utf-8")
+            if isinstance(item, bytes):
+                length = len(item)
+                if length < 4096:
+                    iov.append(_LEN_CACHE[length])
+                else:
+                    iov.append(b"$%d\r\n" % length)
+                iov.append(item)
+                iov.append(b"\r\n")
+            else:
+                iov.append(self._encode(item))
+
+    def _write_list(self, conn, values: list) -> None:
+        iov = []
+        self._encode_iov(values, iov)
+
+        # Kernels cap the vector length (IOV_MAX, typically 1024)
+        if len(iov) > 1024:
+            conn.sendall(b"".join(iov))
+            return
+
+        sendmsg = getattr(conn, 'sendmsg', None)
+        if sendmsg is None:
+            # The socket does not support sendmsg here
+            conn.sendall(b"".join(iov))
+            return
+
+        total = 0
+        for part in iov:
+            total += len(part)
+        sent = sendmsg(iov)
+        # sendmsg may stop short; push the remainder with sendall
+        if sent < total:
+            conn.sendall(b"".join(iov)[sent:])
+
+    # Encodes one value into a single bytes chunk.
+    # A work stack walks nested containers without recursing,
+    # so encoding costs a loop iteration per node instead of a
+    # Python call, then one b''.join builds the final chunk
+    def _encode(self, data: Any) -> bytes:
+        out = []
+        stack = [data]
+
+        while stack:
+            data = stack.pop()
+
+            if isinstance(data, str):
+                data = data.encode("utf-8")
+
+            if isinstance(data, bytes):
+                length = len(data)
+                if length < 4096:
+                    out.append(_LEN_CACHE[length])
+                    out.append(data)
+                    out.append(b"\r\n")
+                else:
+                    out.append(b"$%d\r\n%s\r\n" % (length, data))
+
+            elif isinstance(data, int):
+                if 0 <= data < 1024:
+                    out.append(_INT_CACHE[data])
+                else:
+                    out.append(b":%d\r\n" % data)
+
+            elif isinstance(data, Error):
+                msg = data.message
+                if isinstance(msg, str):
+                    msg = msg.encode("utf-8")
+                out.append(b"-%s\r\n" % msg)
+
+            elif isinstance(data, (list, tuple)):
+                out.append(b"*%d\r\n" % len(data))
+                # Reversed so the pop order matches the wire order
+                stack.extend(reversed(data))
+
+            elif isinstance(data, dict):
+                out.append(b"%%%d\r\n" % len(data))
+                flat = []
+                for key, value in data.items():
+                    flat.append(key)
+                    flat.append(value)
+                stack.extend(reversed(flat))
+
+            elif data is None:
+                out.append(b"$-1\r\n")
+
+            else:
+                raise CommandError('Unrecognized type: %s' % type(data))
+
+        # Scalar responses skip the join entirely
+        if len(out) == 1:
+            return out[0]
+        return b"".join(out)
+
+# Optional compiled accelerator (see protocol.pyx).
+# When it has been built with "python setup.py build_ext --inplace",
+# its ProtocolHandler and wire level types replace the pure Python
+# ones above, so everything below keeps matching the same classes
+try:
+    from protocol import ProtocolHandler, CommandError, Disconnect, Error
+except ImportError:
+    pass
+
+# Optional compiled KV store (see kvstore.pyx); a plain dict has
+# the same interface and serves as the fallback
+try:
+    from kvstore import KV
+except ImportError:
+    KV = dict
 
 class Server(object):
     # Localhost only
-    def __init__(self, host = '127.0.0.1', port = 31337, max_clients = 64):
+    def __init__(self, host: str = '127.0.0.1', port: int = 31337, max_clients: int = 64) -> None:
         self._pool = Pool(max_clients) # Prevents memory exhaustion
         self._server = StreamServer(
             (host, port),
@@ -138,11 +403,13 @@ class Server(object):
         )
 
         self._protocol = ProtocolHandler()
-        self._kv = {}
+        self._kv = KV()
         self._commands = self.get_commands()
+        # Free list of read buffers reused across connections
+        self._buf_pool = deque()
 
-    def get_commands(self):
-        return {
+    def get_commands(self) -> dict:
+        commands = {
             'GET': self.get,
             'SET': self.set,
             'DELETE': self.delete,
@@ -151,40 +418,105 @@ class Server(object):
             'MSET': self.mset
         }
 
+        # Registers the upper and lower case spellings up front,
+        # as bytes, so the common case dispatches on the raw token
+        # with one dict hit and no decode or .upper() allocation
+        table = {}
+        for name, handler in commands.items():
+            table[name.encode("utf-8")] = handler
+            table[name.lower().encode("utf-8")] = handler
+        return table
+
+    # Hands out a pooled read buffer, or a fresh one when the
+    # pool is empty, so connection churn does not keep
+    # reallocating 64KB chunks
+    def _acquire_buf(self) -> bytearray:
+        if self._buf_pool:
+            return self._buf_pool.pop()
+        return bytearray(SocketReader.chunk_size)
+
+    def _release_buf(self, buf: bytearray) -> None:
+        # Caps the pool so idle periods do not pin memory
+        if len(self._buf_pool) < 128:
+            self._buf_pool.append(buf)
+
     # Runs once per client connection
-    def connection_handler(self, conn, address):
+    def connection_handler(self, conn, address) -> None:
         logger.info("Connection received: %s:%s", address[0], address[1])
-        # Converts "conn", which is a socket object, into a file like object
-        socket_file = conn.makefile('rwb')
-
-        # Processes client requests until the client disconnects
-        while True:
-            try:
-                data = self._protocol.handle_request(socket_file)
-            except Disconnect:
-                logger.info("Client disconnected: %s:%s", address[0], address[1])
-                break
+        # Replies go out in one sendall each, so Nagle only adds latency
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Wraps "conn", which is a socket object, in a buffered reader.
+        # Only reads go through it; writes use conn.sendall directly
+        chunk = self._acquire_buf()
+        socket_file = SocketReader(conn, chunk)
+
+        # Collects replies while the client still has pipelined
+        # requests buffered, then sends the batch in one sendall
+        out = bytearray()
+
+        # has_buffered() cannot tell a complete pipelined request
+        # from a partial one, so any batched replies must go out
+        # before the reader blocks on the network; otherwise a
+        # client waiting for reply N before finishing request N+1
+        # would deadlock against the server
+        def _flush_batch():
+            if out:
+                conn.sendall(out)
+                del out[:]
+
+        socket_file.pre_recv = _flush_batch
 
-            try:
-                resp = self.get_response(data)
-            except CommandError as exc:
-                logger.exception('Command error')
-                resp = Error(exc.args[0])
-
-            self._protocol.write_response(socket_file, resp)
+        try:
+            # Processes client requests until the client disconnects
+            while True:
+                try:
+                    data = self._protocol.handle_request(socket_file)
+                except Disconnect:
+                    logger.info("Client disconnected: %s:%s", address[0], address[1])
+                    break
+
+                try:
+                    resp = self.get_response(data)
+                except CommandError as exc:
+                    logger.exception('Command error')
+                    resp = Error(exc.args[0])
+
+                if type(resp) is Raw:
+                    # Already on the wire format; no serialization
+                    encoded = resp.data
+                elif not (socket_file.has_buffered() or out):
+                    # Single request in flight; replies immediately,
+                    # arrays through the vectored path
+                    self._protocol.write_response(conn, resp)
+                    continue
+                else:
+                    encoded = self._protocol._encode(resp)
+
+                if socket_file.has_buffered():
+                    # More requests are already waiting; batching
+                    # this reply costs the pipelining client nothing
+                    out += encoded
+                elif out:
+                    out += encoded
+                    conn.sendall(out)
+                    del out[:]
+                else:
+                    conn.sendall(encoded)
+        finally:
+            self._release_buf(chunk)
 
     # Unpacks the data sent by the client,
     # excecutes the command they specified, 
     # and passes back the return value
-    def get_response(self, data):
+    def get_response(self, data: Any) -> Any:
         # If client sent a simple string, split it into tokens
         # If client sent an array, it should already be a list
         if not isinstance(data, list):
             try:
-                if isinstance(data, bytes):
-                    data = data.decode("utf-8", errors = "strict")
-                data = data.split()
-            except:
+                if isinstance(data, str):
+                    data = data.encode("utf-8")
+                data = _INLINE_RE.findall(data)
+            except TypeError:
                 raise CommandError("Request must be a list or simple string")
         
         if not data:
@@ -192,49 +524,47 @@ class Server(object):
         
         cmd = data[0]
 
-        if isinstance(cmd, bytes):
-            cmd = cmd.decode("utf-8", errors = "strict")
-        command = cmd.upper()
+        if isinstance(cmd, str):
+            cmd = cmd.encode("utf-8")
 
-        if command not in self._commands:
-            raise CommandError('Unrecognized command: %s' % command)
-        
-        logger.debug('Received %s', command)
+        handler = self._commands.get(cmd)
+        if handler is None:
+            # Mixed case spellings fall back to one normalization
+            handler = self._commands.get(cmd.upper())
+            if handler is None:
+                raise CommandError(
+                    'Unrecognized command: %s' % cmd.decode("utf-8", errors = "replace"))
 
-        args = []
-        for x in data[1:]:
-            if isinstance(x, bytes):
-                args.append(x.decode("utf-8", errors = "strict"))
-            else:
-                args.append(x)
-        
-        return self._commands[command](*args)
+        logger.debug('Received %s', cmd)
+
+        # Arguments stay as the raw bytes the parser produced
+        return handler(*data[1:])
 
-    def run(self):
+    def run(self) -> None:
         self._server.serve_forever()
 
-    def get(self, key):
+    def get(self, key: bytes) -> Any:
         return self._kv.get(key)
     
-    def set(self, key, value):
+    def set(self, key: bytes, value: bytes) -> Raw:
         self._kv[key] = value
-        return 1
-    
-    def delete(self, key):
+        return _ONE
+
+    def delete(self, key: bytes) -> Raw:
         if key in self._kv:
             del self._kv[key]
-            return 1
-        return 0
+            return _ONE
+        return _ZERO
     
-    def flush(self):
+    def flush(self) -> int:
         kvlen = len(self._kv)
         self._kv.clear()
         return kvlen
     
-    def mget(self, *keys):
+    def mget(self, *keys: bytes) -> list:
         return [self._kv.get(key) for key in keys]
     
-    def mset(self, *items):
+    def mset(self, *items: bytes) -> int:
         if len(items) % 2 != 0:
             raise CommandError("MSET requires an even number of arguments")
 
@@ -244,14 +574,15 @@ class Server(object):
         return len(pairs)
 
 class Client(object):
-    def __init__(self, host = '127.0.0.1', port = 31337):
+    def __init__(self, host: str = '127.0.0.1', port: int = 31337) -> None:
         self._protocol = ProtocolHandler()
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self._socket.connect((host, port))
-        self._fh = self._socket.makefile('rwb')
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._fh = SocketReader(self._socket)
 
-    def execute(self, *args):
-        self._protocol.write_response(self._fh, list(args))
+    def execute(self, *args) -> Any:
+        self._protocol.write_response(self._socket, list(args))
         resp = self._protocol.handle_request(self._fh)
         if isinstance(resp, Error):
             raise CommandError(resp.message)
@@ -0,0 +1,20 @@
+# Builds the optional compiled accelerators:
+#   python setup.py build_ext --inplace
+# The server runs fine without them; server.py falls back to the
+# pure Python ProtocolHandler and a plain dict store when the
+# extensions are missing
+from setuptools import setup
+from Cython.Build import cythonize
+
+setup(
+    name = 'mini-redis',
+    ext_modules = cythonize(
+        ['protocol.pyx', 'kvstore.pyx'],
+        # boundscheck is set per module: off in kvstore.pyx, whose
+        # indices are masked internally, and on in protocol.pyx,
+        # whose indices come from wire data
+        compiler_directives = {
+            'language_level': 3,
+        },
+    ),
+)